@@ -1,21 +1,52 @@
 import os
-import json
-import uuid
+import re
+import time
+import random
+import hashlib
+import datetime
+import collections
+import threading
 import shutil
+import tempfile
 import logging
 import subprocess
-from flask import Flask, request, Response, jsonify
+import orjson
+from flask import Flask, request, Response, jsonify, abort, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from google.cloud import storage
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from inline_exec import inline_exec_available, run_code_inline, start_inline_executor
+from sandbox import (
+    DOCKER_IMAGES, DOCKER_CLI_TIMEOUT, EXEC_TIMEOUT,
+    docker_status, docker_available, invalidate_docker_status,
+    ensure_sandbox, start_sandboxes, mark_sandbox_stale, create_run_dir, exec_command
+)
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Fork the inline execution helper first, while this process still has a single thread
+INLINE_EXEC_ENABLED = os.getenv('ALLOW_INLINE_EXEC') == '1'
+if INLINE_EXEC_ENABLED:
+    start_inline_executor()
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configure Google Gemini
@@ -24,76 +55,271 @@ if not GOOGLE_API_KEY:
     logger.error("GOOGLE_API_KEY environment variable not set!")
     raise ValueError("GOOGLE_API_KEY environment variable is required")
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-pro')
+GEMINI_MODEL = 'gemini-pro'
+
+def _os_thread_local():
+    """Create a thread-local that stays per OS thread even when gevent has patched threading"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return threading.local()
+    if monkey.is_module_patched('threading'):
+        # Patched threading.local is per greenlet, i.e. per request under gevent workers
+        return monkey.get_original('threading', 'local')()
+    return threading.local()
+
+class GeminiPool:
+    """Hands out one GenerativeModel per worker thread so models are built once and reused"""
+    
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._local = _os_thread_local()
+    
+    def get(self):
+        model = getattr(self._local, 'model', None)
+        if model is None:
+            logger.debug(f"Creating {self.model_name} model for thread {threading.current_thread().name}")
+            model = genai.GenerativeModel(self.model_name)
+            self._local.model = model
+        return model
+
+# gRPC keeps one persistent HTTP/2 channel for the whole process
+genai.configure(api_key=GOOGLE_API_KEY, transport='grpc')
+model_pool = GeminiPool(GEMINI_MODEL)
 
 # Constants
 MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.25  # seconds, doubled on every attempt
+RETRY_MAX_DELAY = 8  # seconds
+RESPONSE_CACHE_SIZE = 512
+CONTEXT_CACHE_ENABLED = os.getenv('GEMINI_CONTEXT_CACHE') == '1'
+CONTEXT_CACHE_MODEL = os.getenv('GEMINI_CONTEXT_CACHE_MODEL', 'models/gemini-1.5-flash-001')
+CONTEXT_CACHE_TTL = datetime.timedelta(minutes=10)
+CONTEXT_CACHE_MARGIN = 30  # seconds before the server-side expiry at which a cache stops being used
+CONTEXT_CACHE_MAX_ENTRIES = 64
+HEALTH_CACHE_TTL = 2  # seconds
+UPLOAD_CHUNK_SIZE = 1 << 20  # bytes copied per read when saving uploads
+UPLOAD_PREVIEW_SIZE = 100  # bytes
+UPLOAD_MAX_SIZE = 16 << 20  # bytes per request body
+UPLOAD_MAX_AGE = 24 * 60 * 60  # seconds since an upload was last stored before it is pruned
+UPLOAD_PRUNE_INTERVAL = 10 * 60  # seconds between prune passes
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_SIZE
 
-# Docker configuration
-DOCKER_IMAGES = {
-    "python": {
-        "image": "stellar-python-sandbox:3.12", 
-        "file": "main.py", 
-        "command": ["python", "main.py"]
-    },
-    "cpp": {
-        "image": "stellar-cpp-sandbox:latest", 
-        "file": "main.cpp", 
-        "command": ["g++", "main.cpp", "-o", "main", "&&", "./main"]
-    },
-    "java": {
-        "image": "stellar-java-sandbox:latest", 
-        "file": "Main.java", 
-        "command": ["javac", "Main.java", "&&", "java", "Main"]
-    },
-    "html": {
-        "image": None, 
-        "file": "index.html", 
-        "command": None
-    }
+# Pre-encoded SSE frame prefixes for the events generation_logic emits
+_EVENT_PREFIXES = {
+    event: f"event: {event}\ndata: ".encode()
+    for event in ("status", "token", "reset", "final_code", "error")
 }
 
 def stream_message(event, data):
     """Helper function to format server-sent events"""
     logger.debug(f"Streaming: {event} - {data}")
-    message = json.dumps(data)
-    yield f"event: {event}\n"
-    yield f"data: {message}\n\n"
+    prefix = _EVENT_PREFIXES.get(event)
+    if prefix is None:
+        prefix = b"event: " + event.encode() + b"\ndata: "
+    yield prefix + orjson.dumps(data) + b"\n\n"
+
+def _make_emitter(event):
+    """Build a stream_message specialized for one event, with its prefix bound up front"""
+    prefix = _EVENT_PREFIXES[event]
+    
+    def emit(data):
+        logger.debug("Streaming: %s - %s", event, data)
+        yield prefix + orjson.dumps(data) + b"\n\n"
+    
+    emit.__name__ = f"emit_{event}"
+    return emit
+
+# Specialized emitters for the events sent on every generation
+emit_status = _make_emitter("status")
+emit_token = _make_emitter("token")
+emit_reset = _make_emitter("reset")
+emit_final_code = _make_emitter("final_code")
+emit_error = _make_emitter("error")
+
+# Gemini context caches for uploaded file contents, keyed by content digest.
+# _context_caches_lock only guards the dicts; creating a cache happens under a per-digest lock
+# so a slow create() for one file never holds up generations for other files.
+_context_caches = {}
+_context_cache_locks = {}
+_context_caches_lock = threading.Lock()
+
+def _evict_context_caches(now):
+    """Drop expired entries and trim to CONTEXT_CACHE_MAX_ENTRIES; returns live caches that were evicted.
+    
+    The caller must hold _context_caches_lock.
+    """
+    for digest in [d for d, (_, expires_at) in _context_caches.items() if expires_at <= now]:
+        # Expired entries have already gone away on the server
+        del _context_caches[digest]
+        _context_cache_locks.pop(digest, None)
+    
+    evicted = []
+    while len(_context_caches) > CONTEXT_CACHE_MAX_ENTRIES:
+        digest = min(_context_caches, key=lambda d: _context_caches[d][1])
+        cached, _ = _context_caches.pop(digest)
+        _context_cache_locks.pop(digest, None)
+        if cached is not None:
+            evicted.append(cached)
+    return evicted
+
+def _get_context_model(file_content):
+    """Return a model bound to a cached copy of file_content, or None if unavailable"""
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    
+    digest = hashlib.sha256(file_content.encode('utf-8')).hexdigest()
+    with _context_caches_lock:
+        cached, expires_at = _context_caches.get(digest, (None, 0.0))
+        digest_lock = _context_cache_locks.setdefault(digest, threading.Lock())
+    
+    if time.monotonic() >= expires_at:
+        with digest_lock:
+            # Another request may have created the cache while we waited for the lock
+            with _context_caches_lock:
+                cached, expires_at = _context_caches.get(digest, (None, 0.0))
+            
+            if time.monotonic() >= expires_at:
+                # Start the clock before create() so the local entry never outlives the server's
+                started = time.monotonic()
+                try:
+                    cached = genai.caching.CachedContent.create(
+                        model=CONTEXT_CACHE_MODEL,
+                        contents=[file_content],
+                        ttl=CONTEXT_CACHE_TTL
+                    )
+                    logger.debug(f"Created Gemini context cache for file {digest[:12]}")
+                except Exception as e:
+                    # Files below the minimum cacheable size end up here too
+                    logger.warning(f"Context caching unavailable for file {digest[:12]}: {str(e)}")
+                    cached = None
+                
+                expires_at = started + CONTEXT_CACHE_TTL.total_seconds() - CONTEXT_CACHE_MARGIN
+                with _context_caches_lock:
+                    _context_caches[digest] = (cached, expires_at)
+                    evicted = _evict_context_caches(time.monotonic())
+                
+                for stale in evicted:
+                    try:
+                        stale.delete()
+                    except Exception as e:
+                        logger.warning(f"Failed to delete Gemini context cache: {str(e)}")
+    
+    if cached is None:
+        return None
+    return genai.GenerativeModel.from_cached_content(cached)
+
+# LRU cache of generated code keyed by (language, sha256 of the full prompt)
+_response_cache = collections.OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _get_cached_response(key):
+    """Return the cached response text for key, or None on a miss"""
+    with _response_cache_lock:
+        text = _response_cache.get(key)
+        if text is not None:
+            _response_cache.move_to_end(key)
+        return text
+
+def _cache_response(key, text):
+    """Store a response text, evicting the least recently used entry when full"""
+    with _response_cache_lock:
+        _response_cache[key] = text
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+class EmptyResponseError(Exception):
+    """Raised when Gemini finishes a response without producing any text"""
+
+# Errors worth retrying; anything else (bad requests, auth, safety blocks) fails fast
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    EmptyResponseError,
+)
+
+def _stream_generate(full_prompt, prompt, file_content=None):
+    """Stream generated text from Gemini chunk by chunk"""
+    # With a context cache for the file only the user prompt has to be sent
+    context_model = _get_context_model(file_content) if file_content is not None else None
+    if context_model is not None:
+        response = context_model.generate_content(prompt, stream=True)
+    else:
+        response = model_pool.get().generate_content(full_prompt, stream=True)
+    
+    for chunk in response:
+        yield chunk.text
+
+# Uploads are stored under the SHA-256 hex digest of their content
+_UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+def uploaded_file_path(file_id):
+    """Map an upload id to its path in UPLOAD_FOLDER, or None if it is not a valid upload id"""
+    if not isinstance(file_id, str) or not _UPLOAD_ID_PATTERN.fullmatch(file_id):
+        return None
+    return os.path.join(app.config['UPLOAD_FOLDER'], file_id)
+
+def read_uploaded_file(uploaded_file_info):
+    """Load an uploaded file's content from disk, falling back to content sent inline by the client"""
+    path = uploaded_file_path(uploaded_file_info.get('id'))
+    if path and os.path.isfile(path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+    return uploaded_file_info.get('content')
 
 def generation_logic(prompt, language, uploaded_file_info=None):
     """Core logic for code generation"""
     logger.debug(f"Generation started: prompt={prompt}, language={language}, file_info={uploaded_file_info}")
     
     try:
+        # Load the uploaded file once rather than on every attempt
+        file_content = read_uploaded_file(uploaded_file_info) if uploaded_file_info else None
+        if uploaded_file_info and file_content is None:
+            # Don't silently generate from the bare prompt when the referenced file is gone
+            logger.warning(f"Uploaded file not found: {uploaded_file_info.get('id')}")
+            yield from emit_error({"message": "Uploaded file not found"})
+            return
+        
+        # Prepare the prompt with file context if provided; it is identical for every attempt
+        full_prompt = prompt
+        if file_content is not None:
+            full_prompt = f"File content:\n{file_content}\n\nPrompt: {prompt}"
+        full_prompt_preview = full_prompt[:100]
+        cache_key = (language, hashlib.sha256(full_prompt.encode('utf-8')).hexdigest())
+        
         for attempt in range(MAX_RETRIES):
-            yield from stream_message("status", {
+            yield from emit_status({
                 "message": f"Attempt {attempt + 1}/{MAX_RETRIES}: Generating code..."
             })
             
+            chunks = []
             try:
-                # Prepare the prompt with file context if provided
-                full_prompt = prompt
-                if uploaded_file_info:
-                    full_prompt = f"File content:\n{uploaded_file_info['content']}\n\nPrompt: {prompt}"
-                
-                logger.debug(f"Sending prompt to Gemini: {full_prompt[:100]}...")
+                logger.debug(f"Sending prompt to Gemini: {full_prompt_preview}...")
                 
-                # Generate code using Gemini
-                response = model.generate_content(full_prompt)
+                # Reuse earlier responses for identical prompts
+                generated_code = _get_cached_response(cache_key)
                 
-                if not response:
-                    logger.warning(f"Attempt {attempt + 1}: No response from Gemini")
-                    continue
+                if generated_code is None:
+                    # Forward each chunk as soon as Gemini produces it
+                    for text in _stream_generate(full_prompt, prompt, file_content):
+                        chunks.append(text)
+                        yield from emit_token({"delta": text})
+                    
+                    generated_code = "".join(chunks)
+                    if not generated_code:
+                        raise EmptyResponseError("No response from Gemini")
+                    _cache_response(cache_key, generated_code)
                 
-                generated_code = response.text
                 logger.debug(f"Generated code (first 100 chars): {generated_code[:100]}...")
                 
                 # Send the generated code
-                yield from stream_message("final_code", {
+                yield from emit_final_code({
                     "code": generated_code,
                     "output": ""  # You can add code execution output here if needed
                 })
@@ -101,19 +327,40 @@ def generation_logic(prompt, language, uploaded_file_info=None):
                 
             except Exception as e:
                 logger.error(f"Attempt {attempt + 1} failed: {str(e)}")
-                if attempt == MAX_RETRIES - 1:
+                if attempt == MAX_RETRIES - 1 or not isinstance(e, TRANSIENT_ERRORS):
                     raise
-                yield from stream_message("status", {
-                    "message": f"Attempt failed: {str(e)}. Retrying..."
+                
+                if chunks:
+                    # The retry streams the answer from the start; drop this attempt's partial output
+                    yield from emit_reset({"attempt": attempt + 1})
+                
+                # Exponential backoff with full jitter; tell the client how long we will wait
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                yield from emit_status({
+                    "message": f"Attempt failed: {str(e)}. Retrying in {delay:.1f}s...",
+                    "retry_in": round(delay, 2)
                 })
+                time.sleep(delay)
     
     except Exception as e:
-        logger.error(f"Generation failed after {MAX_RETRIES} attempts: {str(e)}")
+        logger.error(f"Generation failed: {str(e)}")
         logger.error("Full traceback:", exc_info=True)
-        yield from stream_message("error", {
+        yield from emit_error({
             "message": f"Code generation failed: {str(e)}"
         })
 
+def sse_error(message):
+    """Build a one-event SSE response carrying an error message"""
+    return Response(
+        _EVENT_PREFIXES["error"] + orjson.dumps({"message": message}) + b"\n\n",
+        content_type='text/event-stream'
+    )
+
+def parse_body():
+    """Parse the JSON request body with orjson, returning None if it is empty"""
+    body = request.get_data()
+    return orjson.loads(body) if body else None
+
 @app.route('/generate', methods=['GET', 'POST'])
 def generate():
     """Endpoint for code generation"""
@@ -121,13 +368,10 @@ def generate():
         logger.debug(f"Received {request.method} request to /generate")
         
         if request.method == 'POST':
-            data = request.get_json()
+            data = parse_body()
             if not data:
                 logger.warning("No JSON data provided in POST request")
-                return Response(
-                    'event: error\ndata: {"message": "No JSON data provided"}\n\n',
-                    content_type='text/event-stream'
-                )
+                return sse_error("No JSON data provided")
             prompt = data.get('prompt')
             language = data.get('language')
             uploaded_file_info = data.get('uploaded_file_info')
@@ -140,29 +384,21 @@ def generate():
         
         if not prompt:
             logger.warning("Missing required parameter: prompt")
-            return Response(
-                'event: error\ndata: {"message": "Prompt is required"}\n\n',
-                content_type='text/event-stream'
-            )
+            return sse_error("Prompt is required")
         
         if not language:
             logger.warning("Missing required parameter: language")
-            return Response(
-                'event: error\ndata: {"message": "Language is required"}\n\n',
-                content_type='text/event-stream'
-            )
+            return sse_error("Language is required")
         
         return Response(
             generation_logic(prompt, language, uploaded_file_info), 
-            content_type='text/event-stream'
+            content_type='text/event-stream',
+            direct_passthrough=True
         )
     
     except Exception as e:
         logger.error("Error in generate endpoint:", exc_info=True)
-        return Response(
-            f'event: error\ndata: {{"message": "Server error: {str(e)}"}}\n\n',
-            content_type='text/event-stream'
-        )
+        return sse_error(f"Server error: {str(e)}")
 
 @app.route('/test', methods=['GET'])
 def test_endpoint():
@@ -170,7 +406,7 @@ def test_endpoint():
     try:
         logger.debug("Test endpoint called")
         # Test Gemini API connection
-        test_response = model.generate_content("Say 'Hello, World!'")
+        test_response = model_pool.get().generate_content("Say 'Hello, World!'")
         return jsonify({
             "status": "success",
             "message": "Server is working",
@@ -183,41 +419,50 @@ def test_endpoint():
             "message": str(e)
         }), 500
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Check if Docker and all services are working"""
-    status = {
-        "flask": "running",
-        "docker": "unknown",
-        "sandboxes": {}
-    }
+# Only the docker and sandbox states vary between health responses
+_HEALTH_TEMPLATE = b'{"flask":"running","docker":%s,"sandboxes":%s}'
+_health_cache = {"body": None, "ts": 0.0}
+_health_cache_lock = threading.Lock()
+
+def sandbox_states():
+    """Return the state of each language's sandbox container"""
+    languages = [language for language in DOCKER_IMAGES if language != "html"]  # HTML doesn't need a sandbox
     
-    # Check Docker
+    # One `docker ps` for all containers instead of a `docker inspect` per language
     try:
-        docker_info = subprocess.run(["docker", "info"], capture_output=True, text=True)
-        status["docker"] = "running" if docker_info.returncode == 0 else "not running"
-    except FileNotFoundError:
-        status["docker"] = "not installed"
+        ps = subprocess.run(
+            ["docker", "ps", "-a", "--format", "{{.Names}} {{.State}}"],
+            capture_output=True, text=True, timeout=DOCKER_CLI_TIMEOUT
+        )
+    except Exception:  # includes TimeoutExpired from a hung daemon
+        return {language: "error checking" for language in languages}
+    if ps.returncode != 0:
+        return {language: "error checking" for language in languages}
     
-    # Check each sandbox container
-    for language in DOCKER_IMAGES:
-        if language == "html":
-            continue  # HTML doesn't need a sandbox
-            
-        container_name = f"{language}-sandbox"
-        try:
-            check = subprocess.run(
-                ["docker", "inspect", "--format={{.State.Running}}", container_name],
-                capture_output=True, text=True
-            )
-            status["sandboxes"][language] = "running" if check.returncode == 0 and "true" in check.stdout else "not running"
-        except Exception:
-            status["sandboxes"][language] = "error checking"
+    containers = dict(line.split(" ", 1) for line in ps.stdout.splitlines() if " " in line)
+    return {
+        language: "running" if containers.get(f"{language}-sandbox") == "running" else "not running"
+        for language in languages
+    }
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Check if Docker and all services are working"""
+    with _health_cache_lock:
+        body = _health_cache["body"]
+        if body is None or time.monotonic() - _health_cache["ts"] >= HEALTH_CACHE_TTL:
+            body = _HEALTH_TEMPLATE % (orjson.dumps(docker_status()), orjson.dumps(sandbox_states()))
+            _health_cache["body"] = body
+            _health_cache["ts"] = time.monotonic()
     
-    return jsonify(status)
+    return Response(body, mimetype='application/json', direct_passthrough=True)
 
 def run_code_locally(code, language, uploaded_file_info=None):
     """Fallback function if Docker is not available"""
+    if language == "python" and inline_exec_available():
+        # WARNING: runs untrusted code on the server host without a container; development only
+        return run_code_inline(code)
+    
     if language == "python":
         try:
             # WARNING: This is a security risk for production use!
@@ -249,14 +494,12 @@ def run_code_in_docker(code, language, uploaded_file_info=None):
         return 0, "Language not supported for server-side execution.", ""
     
     # Check if Docker is running
-    try:
-        subprocess.run(["docker", "info"], capture_output=True, check=True)
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    if not docker_available():
         logger.warning("Docker not available, falling back to local execution")
         return run_code_locally(code, language, uploaded_file_info)
     
-    temp_dir = f"./temp_run_{uuid.uuid4()}"
-    os.makedirs(temp_dir, exist_ok=True)
+    temp_dir = create_run_dir()
+    run_id = os.path.basename(temp_dir)
     
     try:
         code_file_path = os.path.join(temp_dir, lang_config["file"])
@@ -264,59 +507,106 @@ def run_code_in_docker(code, language, uploaded_file_info=None):
             f.write(code)
         
         if uploaded_file_info:
-            source_path = os.path.join(app.config['UPLOAD_FOLDER'], uploaded_file_info['id'])
-            dest_path = os.path.join(temp_dir, uploaded_file_info['name'])
-            if os.path.exists(source_path):
-                shutil.copy(source_path, dest_path)
-        
-        # Use the container name if using Docker Compose
-        container_name = f"{language}-sandbox"
+            source_path = uploaded_file_path(uploaded_file_info.get('id'))
+            dest_name = os.path.basename(uploaded_file_info.get('name') or '')
+            dest_path = os.path.join(temp_dir, dest_name)
+            if source_path and os.path.isfile(source_path) and dest_name not in ('', '.', '..'):
+                try:
+                    # Share the stored upload's inode instead of copying its bytes
+                    os.link(source_path, dest_path)
+                except OSError:
+                    # Hard links cannot cross filesystems, e.g. into a tmpfs work dir
+                    shutil.copy(source_path, dest_path)
         
-        # Try to use the specific container, or fall back to creating a new one
-        try:
-            # Check if our sandbox container exists and is running
-            check_container = subprocess.run(
-                ["docker", "inspect", "--format={{.State.Running}}", container_name],
-                capture_output=True, text=True
-            )
-            
-            if check_container.returncode != 0 or "true" not in check_container.stdout:
-                # Container doesn't exist or isn't running, create a new one
-                docker_command = ["docker", "run", "--rm", "-v", f"{os.path.abspath(temp_dir)}:/app", "-w", "/app", lang_config["image"]]
-            else:
-                # Use the existing container
-                docker_command = ["docker", "exec", "-i", "-w", "/app", container_name]
-                
-        except Exception:
-            # Fallback to creating a new container
-            docker_command = ["docker", "run", "--rm", "-v", f"{os.path.abspath(temp_dir)}:/app", "-w", "/app", lang_config["image"]]
+        # Execute inside the long-lived sandbox, which sees this run under the shared mount
+        if not ensure_sandbox(language):
+            return 1, "", f"Sandbox container for {language} could not be started"
         
-        docker_command.extend(lang_config["command"])
+        docker_command = exec_command(language, run_id)
         
+        # Read raw bytes and decode once at the end rather than through a text wrapper
         process = subprocess.Popen(
             docker_command, 
             stdout=subprocess.PIPE, 
             stderr=subprocess.PIPE, 
-            text=True, 
-            encoding='utf-8'
+            bufsize=1 << 20
         )
-        stdout, stderr = process.communicate(timeout=30)
+        # communicate() drains both pipes with a selector; under gevent workers the wait is
+        # cooperative, so other requests keep running while the program executes
+        stdout_b, stderr_b = process.communicate(timeout=EXEC_TIMEOUT)
+        stdout = stdout_b.decode('utf-8', 'replace')
+        stderr = stderr_b.decode('utf-8', 'replace')
         return_code = process.returncode
+        if return_code == 125:
+            # 125 means the docker CLI itself failed, e.g. the daemon is unreachable
+            invalidate_docker_status()
+        elif return_code != 0 and stderr.startswith("Error response from daemon"):
+            # The sandbox container went away; start it again on the next run
+            mark_sandbox_stale(language)
         
         return return_code, stdout, stderr
         
     except subprocess.TimeoutExpired:
         process.kill()
-        stdout, stderr = "", "Execution timed out after 30 seconds."
+        stdout, stderr = "", f"Execution timed out after {EXEC_TIMEOUT} seconds."
         return_code = 1
         return return_code, stdout, stderr
         
     except Exception as e:
+        # Docker may have gone away since the last probe
+        invalidate_docker_status()
         return 1, "", f"Docker execution error: {str(e)}"
         
     finally:
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+_upload_prune = {"ts": 0.0}
+_upload_prune_lock = threading.Lock()
+
+def prune_uploads():
+    """Delete uploads and abandoned temp files not stored within UPLOAD_MAX_AGE, at most once per interval"""
+    now = time.time()
+    with _upload_prune_lock:
+        if now - _upload_prune["ts"] < UPLOAD_PRUNE_INTERVAL:
+            return
+        _upload_prune["ts"] = now
+    
+    cutoff = now - UPLOAD_MAX_AGE
+    removed = 0
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # another worker got there first
+    if removed:
+        logger.info(f"Pruned {removed} expired uploads")
+
+def copy_and_hash(src, dst, digest):
+    """Copy src to dst in UPLOAD_CHUNK_SIZE blocks, feeding each block to digest; returns bytes copied"""
+    readinto = getattr(src, 'readinto', None)
+    if readinto is None:
+        size = 0
+        for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+        return size
+    
+    # Reuse one buffer so no per-block bytes objects are allocated
+    buffer = memoryview(bytearray(UPLOAD_CHUNK_SIZE))
+    size = 0
+    while True:
+        n = readinto(buffer)
+        if not n:
+            return size
+        block = buffer[:n]
+        digest.update(block)
+        dst.write(block)
+        size += n
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Endpoint for file uploads"""
@@ -331,21 +621,61 @@ def upload_file():
             logger.warning("Empty filename in upload request")
             return jsonify({"error": "No file selected"}), 400
         
-        # Read and process the file
-        content = file.read().decode('utf-8')
-        logger.debug(f"File uploaded: {file.filename} (size: {len(content)} bytes)")
+        prune_uploads()
+        
+        # Stream the upload to a temp file in fixed-size chunks, hashing it on the way.
+        # hashlib's sha256 runs in OpenSSL, which uses the CPU's SHA extensions when present.
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(prefix='.upload_', dir=app.config['UPLOAD_FOLDER'])
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                size = copy_and_hash(file.stream, dst, digest)
+            
+            # Uploads are stored by content, so repeated uploads share one file
+            file_id = digest.hexdigest()
+            path = uploaded_file_path(file_id)
+            if os.path.isfile(path):
+                logger.debug(f"File {file.filename} already stored as {file_id}")
+                # Restart its age so pruning keeps files that are still being uploaded
+                os.utime(path)
+            else:
+                # Sandboxes read uploads as a different user
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        logger.debug(f"File uploaded: {file.filename} as {file_id} (size: {size} bytes)")
+        
+        with open(path, 'rb') as f:
+            # A multi-byte character may be cut off at the preview boundary
+            preview = f.read(UPLOAD_PREVIEW_SIZE).decode('utf-8', errors='ignore')
         
+        # The full content stays on disk; clients fetch it from /upload/<file_id> when needed
         return jsonify({
-            "file_id": "temp_id",  # You can generate a unique ID if needed
+            "file_id": file_id,
             "filename": file.filename,
-            "preview": content[:100] + "...",  # Preview first 100 chars
-            "content": content
+            "size": size,
+            "preview": preview + "..."
         })
         
+    except RequestEntityTooLarge:
+        logger.warning("Upload rejected: request body too large")
+        return jsonify({"error": f"File too large (limit {UPLOAD_MAX_SIZE} bytes)"}), 413
     except Exception as e:
         logger.error("File upload failed:", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload/<file_id>', methods=['GET'])
+def get_uploaded_file(file_id):
+    """Endpoint for fetching the content of an uploaded file"""
+    path = uploaded_file_path(file_id)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    return send_from_directory(app.config['UPLOAD_FOLDER'], file_id, mimetype='text/plain')
+
+# The block below runs the Werkzeug development server. In production serve the app with
+# gunicorn instead: gunicorn -c gunicorn_conf.py app:app
 if __name__ == '__main__':
     # Check if running in debug mode
     debug_mode = os.getenv('FLASK_ENV') == 'development'
@@ -353,7 +683,10 @@ if __name__ == '__main__':
     # Log startup information
     logger.info(f"Starting Flask server in {'debug' if debug_mode else 'production'} mode")
     logger.info(f"CORS enabled, allowing all origins")
-    logger.info(f"Gemini API configured with model: gemini-pro")
+    logger.info(f"Gemini API configured with model: {GEMINI_MODEL}")
+    
+    # Bring up the sandbox containers before serving requests
+    start_sandboxes()
     
     # Start the server
     app.run(host='0.0.0.0', port=5000, debug=debug_mode)
@@ -0,0 +1,44 @@
+"""Gunicorn settings for the Flask backend.
+
+Run with: gunicorn -c gunicorn_conf.py app:app
+"""
+import os
+import sys
+import subprocess
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+
+# Set GUNICORN_ASYNC=1 to use gevent workers: every open SSE stream is then a greenlet
+# costing a few KB instead of an OS thread, so far more streams fit in one process.
+# gevent also patches subprocess, so waiting on a sandbox run yields to other requests.
+ASYNC_WORKERS = os.getenv('GUNICORN_ASYNC') == '1'
+
+if ASYNC_WORKERS:
+    worker_class = 'gevent'
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+else:
+    # Threaded workers keep /health and /upload responsive while SSE streams wait on Gemini
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# Generation requests can take a while to finish streaming
+timeout = 120
+
+def when_ready(server):
+    # Start the sandbox containers once, before any worker can race to create them. This runs in a
+    # separate interpreter: importing sandbox here would create its locks before gevent patches
+    # the workers, leaving them real thread locks that block a whole worker across docker calls.
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import logging, sandbox; logging.basicConfig(level=logging.INFO); sandbox.start_sandboxes()"],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        server.log.warning("Starting the sandbox containers failed; workers will retry on first use")
+
+def post_worker_init(worker):
+    if ASYNC_WORKERS:
+        # Let the Gemini SDK's gRPC calls yield to other greenlets instead of blocking the worker
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
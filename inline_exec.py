@@ -0,0 +1,189 @@
+"""Opt-in inline execution of Python snippets for the local fallback.
+
+Runs are forked from a helper process that is itself forked once, at import, while the
+server is still single-threaded. Forking the live threaded server instead could deadlock the
+child on locks held by other threads (including gRPC's), and would give every run a copy of
+all those thread stacks.
+"""
+import io
+import os
+import select
+import signal
+import socket
+import struct
+import time
+import marshal
+import resource
+import functools
+import threading
+import contextlib
+import traceback
+
+from sandbox import EXEC_TIMEOUT
+
+INLINE_EXEC_MEMORY_LIMIT = 512 << 20  # bytes of heap per run, on top of what the helper already uses
+RESULT_READ_SIZE = 1 << 16
+
+# Socket to the helper process, and a lock so one request at a time talks to it
+_helper_socket = None
+_helper_lock = threading.Lock()
+
+def start_inline_executor():
+    """Fork the helper process; call this before the server starts any threads"""
+    global _helper_socket
+    parent_sock, helper_sock = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        parent_sock.close()
+        try:
+            _serve(helper_sock)
+        finally:
+            os._exit(0)
+    
+    helper_sock.close()
+    _helper_socket = parent_sock
+
+def inline_exec_available():
+    """Return True while the helper process is up and can take runs"""
+    return _helper_socket is not None
+
+def _drop_helper():
+    """Forget a helper that has died so callers fall back to spawning an interpreter"""
+    global _helper_socket
+    if _helper_socket is not None:
+        _helper_socket.close()
+        _helper_socket = None
+
+def _recv_exact(sock, size):
+    """Read exactly size bytes, or return b'' if the other end closed the socket"""
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return b""
+        data += chunk
+    return data
+
+def _serve(sock):
+    """Helper loop: fork one child per run and hand the requester a pipe carrying its result"""
+    # Let the kernel reap finished runs
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        header = _recv_exact(sock, 4)
+        if not header:
+            return  # the server went away
+        code_bytes = _recv_exact(sock, struct.unpack("!I", header)[0])
+        
+        result_r, result_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            os.close(result_r)
+            # Own process group, so the server can kill the run and anything it spawned by pid
+            os.setsid()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _exec_inline(code_bytes, result_w)
+            finally:
+                os._exit(0)
+        
+        os.close(result_w)
+        socket.send_fds(sock, [struct.pack("!i", pid)], [result_r])
+        os.close(result_r)
+
+def _kill_run(pid):
+    """Kill a run's process group; runs call setsid, so the group id is the child's pid"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass  # the run and everything it started have already exited
+
+def _data_usage():
+    """Return this process's current data segment size in bytes, or 0 if it cannot be read"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmData:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _exec_inline(code_bytes, result_fd):
+    """Run compiled user code under CPU and memory limits and write the result to result_fd"""
+    resource.setrlimit(resource.RLIMIT_CPU, (EXEC_TIMEOUT, EXEC_TIMEOUT))
+    # The forked child already holds the helper's heap, so cap growth beyond that
+    data_limit = _data_usage() + INLINE_EXEC_MEMORY_LIMIT
+    resource.setrlimit(resource.RLIMIT_DATA, (data_limit, data_limit))
+    
+    stdout, stderr = io.StringIO(), io.StringIO()
+    return_code = 0
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            exec(marshal.loads(code_bytes), {"__name__": "__main__"})
+        except SystemExit as e:
+            return_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+            return_code = 1
+    
+    with os.fdopen(result_fd, "wb") as result:
+        result.write(marshal.dumps((return_code, stdout.getvalue(), stderr.getvalue())))
+
+@functools.lru_cache(maxsize=128)
+def _compile_user_code(code):
+    """Compile user code once so repeated runs of the same snippet reuse it; returns marshalled bytes"""
+    return marshal.dumps(compile(code, "<user>", "exec"))
+
+def run_code_inline(code):
+    """Run Python code in a child of the helper process instead of spawning a new interpreter"""
+    if _helper_socket is None:
+        return 1, "", "Inline execution is not available"
+    
+    try:
+        code_bytes = _compile_user_code(code)
+    except SyntaxError as e:
+        return 1, "", "".join(traceback.format_exception_only(type(e), e))
+    
+    with _helper_lock:
+        if _helper_socket is None:
+            return 1, "", "Inline execution is not available"
+        try:
+            _helper_socket.sendall(struct.pack("!I", len(code_bytes)) + code_bytes)
+            msg, fds, _, _ = socket.recv_fds(_helper_socket, 4, 1)
+        except OSError as e:
+            _drop_helper()
+            return 1, "", f"Local execution error: {e}"
+        if len(msg) != 4 or not fds:
+            # The helper exited (or was killed) between runs
+            for fd in fds:
+                os.close(fd)
+            _drop_helper()
+            return 1, "", "Local execution error: inline helper exited"
+    pid = struct.unpack("!i", msg)[0]
+    
+    deadline = time.monotonic() + EXEC_TIMEOUT
+    chunks = []
+    timed_out = False
+    with os.fdopen(fds[0], "rb", buffering=0) as result:
+        # Read until every writer is gone; a process the run spawned may still hold the pipe
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([result], [], [], remaining)[0]:
+                timed_out = True
+                break
+            chunk = result.read(RESULT_READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    # Always clear out the run's process group so nothing it started outlives it
+    _kill_run(pid)
+    
+    data = b"".join(chunks)
+    if timed_out and not data:
+        return 1, "", f"Execution timed out after {EXEC_TIMEOUT} seconds."
+    try:
+        return marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        # The child died before reporting back, e.g. it hit a resource limit
+        return 1, "", "Execution aborted before producing a result"
@@ -0,0 +1,210 @@
+"""Docker sandbox configuration and container management.
+
+Kept apart from app.py so gunicorn_conf.py can start the sandbox containers once, from a
+short-lived interpreter, without importing the Flask app and the Gemini client.
+"""
+import os
+import stat
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+DOCKER_STATUS_TTL = 30  # seconds
+EXEC_TIMEOUT = 30  # seconds
+DOCKER_CLI_TIMEOUT = 10  # seconds for docker info/ps/inspect/run/start calls
+
+SANDBOX_UID = 1000  # the "runner" user the sandbox images run as (see Dockerfile.*)
+
+# Host directory bind-mounted into every sandbox container; each run gets its own subdirectory.
+# Defaults to a per-user directory on tmpfs where available so run files never touch the disk.
+_DEFAULT_WORK_DIR = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), f'stellar-{os.getuid()}'
+)
+SANDBOX_WORK_DIR = os.path.abspath(os.getenv('SANDBOX_WORK_DIR', _DEFAULT_WORK_DIR))
+SANDBOX_MOUNT = "/work"
+
+def _prepare_work_dir(path):
+    """Create the work root, refusing one that another local user could have planted or can write to"""
+    os.makedirs(path, mode=0o711, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RuntimeError(f"Sandbox work dir {path} is not a directory")
+    if st.st_uid != os.getuid():
+        raise RuntimeError(f"Sandbox work dir {path} is owned by uid {st.st_uid}, not {os.getuid()}")
+    if st.st_mode & 0o022:
+        raise RuntimeError(f"Sandbox work dir {path} is writable by other users")
+    # The sandbox user may enter run directories by name but not list them
+    os.chmod(path, 0o711)
+
+_prepare_work_dir(SANDBOX_WORK_DIR)
+
+# Docker configuration
+DOCKER_IMAGES = {
+    "python": {
+        "image": "stellar-python-sandbox:3.12", 
+        "file": "main.py", 
+        "command": ["python", "main.py"]
+    },
+    "cpp": {
+        "image": "stellar-cpp-sandbox:latest", 
+        "file": "main.cpp", 
+        # exec does not interpret "&&", so the compile-then-run step needs an explicit shell
+        "command": ["sh", "-c", "g++ main.cpp -o main && ./main"]
+    },
+    "java": {
+        "image": "stellar-java-sandbox:latest", 
+        "file": "Main.java", 
+        # The single-file source launcher compiles and runs in one JVM, no shell needed
+        "command": ["java", "Main.java"]
+    },
+    "html": {
+        "image": None, 
+        "file": "index.html", 
+        "command": None
+    }
+}
+
+# Everything after `docker exec -i -w <run dir>` for each sandboxed language, built once.
+# The container outlives the docker CLI, so the time limit is enforced inside it as well.
+_EXEC_ARGS = {
+    language: (f"{language}-sandbox", "timeout", "--signal=KILL", str(EXEC_TIMEOUT), *lang_config["command"])
+    for language, lang_config in DOCKER_IMAGES.items()
+    if lang_config["image"]
+}
+
+# Cached result of the `docker info` probe
+_docker_status = {"state": None, "ts": 0.0}
+_docker_status_lock = threading.Lock()
+
+def docker_status():
+    """Return 'running', 'not running' or 'not installed', probing Docker at most every DOCKER_STATUS_TTL seconds"""
+    with _docker_status_lock:
+        if _docker_status["state"] is not None and time.monotonic() - _docker_status["ts"] < DOCKER_STATUS_TTL:
+            return _docker_status["state"]
+        
+        try:
+            docker_info = subprocess.run(["docker", "info"], capture_output=True, timeout=DOCKER_CLI_TIMEOUT)
+            state = "running" if docker_info.returncode == 0 else "not running"
+        except subprocess.TimeoutExpired:
+            # A hung daemon is as good as a stopped one
+            state = "not running"
+        except FileNotFoundError:
+            state = "not installed"
+        
+        _docker_status["state"] = state
+        _docker_status["ts"] = time.monotonic()
+        return state
+
+def docker_available():
+    """Check whether the Docker daemon is reachable"""
+    return docker_status() == "running"
+
+def invalidate_docker_status():
+    """Force the next docker_status() call to probe Docker again"""
+    with _docker_status_lock:
+        _docker_status["state"] = None
+
+# Languages whose long-lived sandbox container is known to be running
+_ready_sandboxes = set()
+_sandboxes_lock = threading.Lock()
+
+def _sandbox_state(container_name):
+    """Return True if the container is running, False if it is stopped, None if it does not exist"""
+    check = subprocess.run(
+        ["docker", "inspect", "--format={{.State.Running}}", container_name],
+        capture_output=True, text=True, timeout=DOCKER_CLI_TIMEOUT
+    )
+    if check.returncode != 0:
+        return None
+    return "true" in check.stdout
+
+def _start_sandbox(language):
+    """Bring up a language's sandbox container; returns True once it is running"""
+    container_name = f"{language}-sandbox"
+    state = _sandbox_state(container_name)
+    if state is None:
+        start = subprocess.run(
+            ["docker", "run", "-d", "--name", container_name,
+             "-v", f"{SANDBOX_WORK_DIR}:{SANDBOX_MOUNT}", "-w", SANDBOX_MOUNT,
+             "--entrypoint", "sleep", DOCKER_IMAGES[language]["image"], "infinity"],
+            capture_output=True, text=True, timeout=DOCKER_CLI_TIMEOUT
+        )
+        if start.returncode == 0:
+            logger.info(f"Started sandbox container {container_name}")
+            state = True
+        else:
+            # A name conflict means someone else created it first; look at theirs
+            state = _sandbox_state(container_name)
+            if state is None:
+                logger.error(f"Failed to start {container_name}: {start.stderr.strip()}")
+                return False
+    
+    if not state:
+        # `docker start` is a no-op if another worker started it in the meantime
+        start = subprocess.run(
+            ["docker", "start", container_name],
+            capture_output=True, text=True, timeout=DOCKER_CLI_TIMEOUT
+        )
+        if start.returncode != 0:
+            logger.error(f"Failed to start {container_name}: {start.stderr.strip()}")
+            return False
+        logger.info(f"Restarted sandbox container {container_name}")
+    
+    return True
+
+def ensure_sandbox(language):
+    """Start the long-lived sandbox container for a language unless it is already running
+    
+    Other gunicorn workers may be doing the same thing at the same moment, so an existing
+    container is only ever started, never removed and recreated.
+    """
+    if language in _ready_sandboxes:
+        return True
+    
+    with _sandboxes_lock:
+        if language in _ready_sandboxes:
+            return True
+        
+        try:
+            if not _start_sandbox(language):
+                return False
+        except subprocess.TimeoutExpired as e:
+            logger.error(f"Timed out starting {language}-sandbox: {e}")
+            return False
+        
+        _ready_sandboxes.add(language)
+        return True
+
+def mark_sandbox_stale(language):
+    """Forget that a sandbox is running so the next run checks it again"""
+    _ready_sandboxes.discard(language)
+
+def create_run_dir():
+    """Create a fresh run directory under the work root that the sandbox user can write to"""
+    run_dir = tempfile.mkdtemp(prefix='run_', dir=SANDBOX_WORK_DIR)
+    uid = os.getuid()
+    if uid == 0:
+        os.chown(run_dir, SANDBOX_UID, -1)
+    elif uid != SANDBOX_UID:
+        # The directory can't be handed over, so let others write into it without listing it;
+        # its random name stays hidden behind the unlistable work root
+        os.chmod(run_dir, 0o733)
+    return run_dir
+
+def exec_command(language, run_id):
+    """Build the docker exec command that runs a language's program in the run directory run_id"""
+    return ["docker", "exec", "-i", "-w", f"{SANDBOX_MOUNT}/{run_id}", *_EXEC_ARGS[language]]
+
+def start_sandboxes():
+    """Start a sandbox container for every language that executes in Docker"""
+    if not docker_available():
+        logger.warning("Docker not available, sandbox containers not started")
+        return
+    
+    for language, lang_config in DOCKER_IMAGES.items():
+        if lang_config["image"]:
+            ensure_sandbox(language)